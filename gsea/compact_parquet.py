@@ -0,0 +1,55 @@
+import os
+import sys
+import argparse
+import pathlib
+import logging
+
+import data_parser
+
+
+# set up logger, using inherited config, in case we get called as a module
+logger = logging.getLogger(__name__)
+
+
+def main(parquets_dir, compact_file):
+    logger.info("Compacting parquet files")
+    data_parser.compact_parquet(parquets_dir, compact_file)
+
+
+if __name__ == "__main__":
+    script_name = os.path.basename(sys.argv[0])
+    # configure logging, sub-modules will inherit this config
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(name)s: %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S',
+                        level=logging.DEBUG)
+    # set up logger: we want script name rather than 'root'
+    logger = logging.getLogger(script_name)
+
+    parser = argparse.ArgumentParser(
+        prog=script_name,
+        description=(
+            """
+            One-time preprocessing: concatenate the many small parquet parts of an
+            Open Targets directory (e.g. target/) into a single parquet file.
+            """
+        )
+    )
+    parser.add_argument("--parquets_dir",
+                        type=pathlib.Path,
+                        required=True,
+                        help="Path to a directory of parquet files with the same schema")
+    parser.add_argument("--compact_file",
+                        type=pathlib.Path,
+                        required=True,
+                        help="Path to the output parquet file")
+
+    args = parser.parse_args()
+
+    try:
+        main(parquets_dir=args.parquets_dir,
+             compact_file=args.compact_file)
+
+    except Exception as e:
+        # details on the issue should be in the exception name, print it to stderr and die
+        sys.stderr.write("ERROR in " + script_name + " : " + repr(e) + "\n")
+        sys.exit(1)
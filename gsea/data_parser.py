@@ -1,109 +1,252 @@
 import os
+import sys
+import functools
 import logging
 
+import numpy
 import pandas
+import pyarrow
+import pyarrow.dataset
+import pyarrow.fs
+import pyarrow.parquet
+
+# the parsed-data cache is shared with the reactome and network_propagation scripts
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import pipeline_cache
 
 # set up logger, using inherited config, in case we get called as a module
 logger = logging.getLogger(__name__)
 
+# parquet files are memory-mapped: pages are read on demand and shared through the page cache
+LOCAL_FS = pyarrow.fs.LocalFileSystem(use_mmap=True)
+
+# the ID columns of the associations repeat a lot: read them dictionary-encoded,
+# so that filters and de-duplication compare integer codes instead of strings
+ASSOCIATIONS_FORMAT = pyarrow.dataset.ParquetFileFormat(
+    read_options=pyarrow.dataset.ParquetReadOptions(
+        dictionary_columns=["diseaseId", "datatypeId", "targetId"]))
+
 
-def parse_target_parquet(target_parquets_dir):
+def list_parquet_files(parquets_dir):
     """
-    Parses target parquet files from Open Targets Platform with 2 columns: id, approvedSymbol
+    List parquet files in a directory (recursively, skipping names starting with "_" or "."),
+    or a single compacted parquet file (see compact_parquet). These are the files read by
+    the pyarrow.dataset scans below
 
     arguments:
-    - target_parquets_dir: directory to Open Targets targets parquets
+    - parquets_dir: directory with parquet files, or path to a parquet file
+
+    returns:
+    - parquet_files: list of paths
+    """
+    dataset = pyarrow.dataset.dataset(parquets_dir, format="parquet", filesystem=LOCAL_FS)
+
+    return(dataset.files)
+
 
-    return:
-    - target2symbol: dict, key=target ID, value=approved symbol
+def compact_parquet(parquets_dir, compact_file):
+    """
+    Concatenate all parquet files of a directory into a single parquet file, one row group
+    at a time, so that later runs open one file instead of many small parts
+
+    arguments:
+    - parquets_dir: directory with parquet files sharing the same schema
+    - compact_file: path to the output parquet file
     """
-    target2symbol = {}
-    parquet_files = []
+    parquet_files = list_parquet_files(parquets_dir)
+    if not parquet_files:
+        logger.error("No parquet files found in %s", parquets_dir)
+        raise Exception("No parquet files to compact")
 
-    for f in os.listdir(target_parquets_dir):
-        if f.endswith(".parquet") or f.endswith(".snappy.parquet"):
-            parquet_file = os.path.join(target_parquets_dir, f)
-            parquet_files.append(parquet_file)
+    schema = pyarrow.parquet.read_schema(parquet_files[0])
+    n_row_groups = 0
 
-    for file in parquet_files:
-        try:
-            dfp = pandas.read_parquet(file, columns=["id", "approvedSymbol"])
-        except Exception:
-            logger.error("Cannot open parquet file %s", file)
-        parquet_target2symbol = (dfp[["id", "approvedSymbol"]]
-                                .drop_duplicates(subset=["id"])
-                                .set_index("id")[ "approvedSymbol"]
-                                .to_dict())
-        target2symbol.update(parquet_target2symbol)
+    with pyarrow.parquet.ParquetWriter(compact_file, schema) as writer:
+        for file in parquet_files:
+            parquet_file = pyarrow.parquet.ParquetFile(file, memory_map=True)
+            if not parquet_file.schema_arrow.equals(schema):
+                logger.error("Parquet file %s has a different schema than %s", file, parquet_files[0])
+                raise Exception("Cannot compact parquet files with different schemas")
+            for i in range(parquet_file.num_row_groups):
+                writer.write_table(parquet_file.read_row_group(i))
+                n_row_groups += 1
 
-    logger.info("Found %i target-symbol associations", len(target2symbol))
+    logger.info("Compacted %i parquet files (%i row groups) into %s",
+                len(parquet_files), n_row_groups, compact_file)
 
-    return(target2symbol)
 
+def read_targets(target_parquets_dir):
+    """
+    Read target parquet files from Open Targets Platform with 2 columns: id, approvedSymbol,
+    targets without an approved symbol are dropped by the reader
+
+    arguments:
+    - target_parquets_dir: directory to Open Targets targets parquets, or a compacted parquet file
+
+    returns:
+    - pyarrow.Table with 2 columns: id, approvedSymbol
+    """
+    try:
+        dataset = pyarrow.dataset.dataset(target_parquets_dir, format="parquet", filesystem=LOCAL_FS)
+        table = dataset.to_table(columns=["id", "approvedSymbol"],
+                                 filter=pyarrow.dataset.field("approvedSymbol").is_valid())
+    except Exception as e:
+        logger.error("Cannot read target parquets in %s: %s", target_parquets_dir, e)
+        raise Exception("Cannot read target parquets")
 
-def parse_associations_parquet(associations_parquets_dir, disease, datatype):
+    return(table)
+
+
+def scan_targets(target_parquets_dir, use_cache=True):
     """
-    Parses associations parquet files from Open Targets Platform with 4 columns:
-    disease_id, datatype, score, target_id
-    Filter on disease and datatype
-    More on the association scores:
-    https://platform.opentargets.org/downloads/association_by_datasource_indirect/schema
+    Scan target parquet files from Open Targets Platform, see read_targets.
+    The result is cached (see pipeline_cache), later runs on the same files memory-map the cache
+
+    arguments:
+    - target_parquets_dir: directory to Open Targets targets parquets, or a compacted parquet file
+    - use_cache: bool, read and write the cache (default: True)
+
+    returns:
+    - pyarrow.Table with 2 columns: id, approvedSymbol
+    """
+    return(pipeline_cache.cached_table(list_parquet_files(target_parquets_dir), "target2symbol",
+                                       functools.partial(read_targets, target_parquets_dir),
+                                       use_cache))
+
+
+def scan_associations(associations_parquets_dir, disease, datatype):
+    """
+    Scan associations parquet files for one disease and datatype, and keep the best score
+    of each target (a target has one row per datasource of the datatype)
+
+    The disease and datatype filters are pushed down to the parquet reader, so row groups
+    that cannot match are skipped and only the targetId and score columns are decoded.
+    If the directory was written by partition_associations_parquet, only the files of
+    the requested disease are opened
 
     arguments:
     - associations_parquets_dir: directory to Open Targets associations parquets
+    - disease: str, disease EFO ID
+    - datatype: str, e.g. genetic_association, or None for all datatypes
 
-    return:
-    - target2score: dict, key=target, value=association score
+    returns:
+    - pyarrow.Table with 2 columns: targetId, score_max
     """
-    target2score = {}
-    parquet_files = []
+    row_filter = pyarrow.dataset.field("diseaseId") == disease
+    # no datatype: keep all datatypes
+    if datatype:
+        row_filter &= pyarrow.dataset.field("datatypeId") == datatype
 
-    for f in os.listdir(associations_parquets_dir):
-        if f.endswith(".parquet") or f.endswith(".snappy.parquet"):
-            parquet_file = os.path.join(associations_parquets_dir, f)
-            parquet_files.append(parquet_file)
+    try:
+        dataset = pyarrow.dataset.dataset(associations_parquets_dir, format=ASSOCIATIONS_FORMAT,
+                                          partitioning="hive", filesystem=LOCAL_FS)
+        table = dataset.to_table(columns=["targetId", "score"], filter=row_filter)
+    except Exception as e:
+        logger.error("Cannot read associations parquets in %s: %s", associations_parquets_dir, e)
+        raise Exception("Cannot read associations parquets")
 
-    for file in parquet_files:
-        try:
-            dfp = pandas.read_parquet(file, columns=["diseaseId", "targetId", "score", "datatypeId"])
-        except Exception:
-            logger.error("Cannot open parquet file %s", file)
-        
-        df_filtered = dfp[(dfp["diseaseId"] == disease) & (dfp["datatypeId"] == datatype)]
+    # every row group of every file is decoded with its own targetId dictionary:
+    # map them onto one shared dictionary, group_by cannot mix differing dictionaries
+    table = table.unify_dictionaries()
 
-        parquet_target2score = (df_filtered[["targetId", "score"]]
-                                .drop_duplicates(subset=["targetId"])
-                                .set_index("targetId")[ "score"]
-                                .to_dict())
-        target2score.update(parquet_target2score)
+    # aggregated in a single Arrow hash pass instead of pandas drop_duplicates
+    return(table.group_by("targetId").aggregate([("score", "max")]))
 
-    logger.info("Found %i target-score associations for %s", len(target2score), disease)
 
-    return(target2score)
+def partition_associations_parquet(associations_parquets_dir, partitioned_dir):
+    """
+    Rewrites associations parquet files from Open Targets Platform Hive-partitioned by
+    diseaseId (one sub-directory diseaseId=<ID> per disease), keeping the 4 columns
+    used by scan_associations, with score stored as float32.
+    The dump is streamed batch by batch from the reader to the writer, never loaded whole
 
+    arguments:
+    - associations_parquets_dir: directory to Open Targets associations parquets
+    - partitioned_dir: output directory
+    """
+    try:
+        dataset = pyarrow.dataset.dataset(associations_parquets_dir, format="parquet", filesystem=LOCAL_FS)
+        # scores are in [0, 1]: float32 keeps ~7 significant digits at half the bytes to scan
+        scanner = dataset.scanner(columns={
+            "diseaseId": pyarrow.dataset.field("diseaseId"),
+            "targetId": pyarrow.dataset.field("targetId"),
+            "score": pyarrow.dataset.field("score").cast(pyarrow.float32()),
+            "datatypeId": pyarrow.dataset.field("datatypeId")})
+    except Exception as e:
+        logger.error("Cannot read associations parquets in %s: %s", associations_parquets_dir, e)
+        raise Exception("Cannot read associations parquets")
+
+    written_files = []
+    pyarrow.dataset.write_dataset(scanner, partitioned_dir,
+                                  format="parquet",
+                                  partitioning=["diseaseId"],
+                                  partitioning_flavor="hive",
+                                  # a batch can hold many diseases, don't cap the partitions per batch
+                                  max_partitions=1_000_000,
+                                  max_rows_per_group=100_000,
+                                  existing_data_behavior="delete_matching",
+                                  file_visitor=written_files.append)
+
+    n_rows = sum(written_file.metadata.num_rows for written_file in written_files)
+    n_diseases = len({os.path.dirname(written_file.path) for written_file in written_files})
+    logger.info("Wrote %i associations for %i diseases to %s", n_rows, n_diseases, partitioned_dir)
+
+
+def select_top_k(gsea_input, top_k):
+    """
+    Keep the top_k highest-scoring rows of a GSEA input, sorted by decreasing score
 
-def build_gsea_input(target2symbol, target2score):
+    arguments:
+    - gsea_input: DataFrame with two columns: symbol, score
+    - top_k: int, or None to keep all rows
+
+    returns:
+    - gsea_input: DataFrame with two columns: symbol, score
     """
-    Create GSEA input as specified here: https://github.com/MaayanLab/blitzgsea
+    if top_k is not None and top_k < 0:
+        logger.error("top_k must be a non-negative number of symbols, got %i", top_k)
+        raise Exception("Bad top_k")
+
+    if top_k is not None and top_k < len(gsea_input):
+        # select the top_k in linear time, only sort those
+        top = numpy.argpartition(-gsea_input[1].to_numpy(), top_k)[:top_k]
+        gsea_input = gsea_input.iloc[top].sort_values(1, ascending=False).reset_index(drop=True)
+        logger.info("Kept the top %i symbols for GSEA", top_k)
+
+    return(gsea_input)
+
+
+def parse_gsea_input(target_parquets_dir, associations_parquets_dir, disease, datatype, top_k=None,
+                     use_cache=True):
+    """
+    Create GSEA input as specified here: https://github.com/MaayanLab/blitzgsea,
+    straight from the Open Targets parquets: the targets and the disease associations
+    are joined on target ID by Arrow
 
     arguments:
-    - target2symbol: dict, key=target, value=approved symbol
-    - target2score: dict, key=target, value=association score
+    - target_parquets_dir: directory to Open Targets targets parquets
+    - associations_parquets_dir: directory to Open Targets associations parquets
+    - disease: str, disease EFO ID
+    - datatype: str, e.g. genetic_association, or None for all datatypes
+    - top_k: int, optional, only keep the top_k highest-scoring symbols (default: all)
+    - use_cache: bool, read and write the cache of the targets (default: True)
 
     returns:
     - gsea_input: DataFrame with two columns: symbol, score
     """
-    symbol2score = {}
+    targets = scan_targets(target_parquets_dir, use_cache)
+    scores = scan_associations(associations_parquets_dir, disease, datatype)
+    logger.info("Found %i target-score associations for %s", len(scores), disease)
 
-    for target in target2score:
-        if target in target2symbol:
-            symbol = target2symbol[target]
-            score = target2score[target]
-            symbol2score[symbol] = score
+    joined = scores.join(targets, keys="targetId", right_keys="id", join_type="inner")
+    # if several targets share a symbol keep the best score
+    joined = joined.group_by("approvedSymbol").aggregate([("score_max", "max")])
+    logger.info("Found %i symbols with a score", len(joined))
 
-    gsea_input = pandas.DataFrame(list(symbol2score.items()))
+    gsea_input = pandas.DataFrame({0: joined["approvedSymbol"].to_numpy(),
+                                   1: joined["score_max_max"].to_numpy()})
 
-    return gsea_input
+    return(select_top_k(gsea_input, top_k))
 
 
 def parse_gmt_file(gmt_file):
@@ -138,5 +281,5 @@ def pathways_to_TSV(pathways):
     - pathways: list of str
     '''
 
-    for pathway in pathways:
-        print(pathway)
\ No newline at end of file
+    # one write for all pathways instead of a print() per line
+    sys.stdout.write("".join(pathway + "\n" for pathway in pathways))
\ No newline at end of file
@@ -0,0 +1,55 @@
+import os
+import sys
+import argparse
+import pathlib
+import logging
+
+import data_parser
+
+
+# set up logger, using inherited config, in case we get called as a module
+logger = logging.getLogger(__name__)
+
+
+def main(associations_parquets_dir, partitioned_dir):
+    logger.info("Partitioning associations parquets by disease")
+    data_parser.partition_associations_parquet(associations_parquets_dir, partitioned_dir)
+
+
+if __name__ == "__main__":
+    script_name = os.path.basename(sys.argv[0])
+    # configure logging, sub-modules will inherit this config
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(name)s: %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S',
+                        level=logging.DEBUG)
+    # set up logger: we want script name rather than 'root'
+    logger = logging.getLogger(script_name)
+
+    parser = argparse.ArgumentParser(
+        prog=script_name,
+        description=(
+            """
+            One-time preprocessing: rewrite Open Targets associations parquets partitioned
+            by disease, so that run_gsea.py only reads the files of the requested disease.
+            """
+        )
+    )
+    parser.add_argument("--associations_parquets_dir",
+                        type=pathlib.Path,
+                        required=True,
+                        help="Path to Open Targets associations parquets")
+    parser.add_argument("--partitioned_dir",
+                        type=pathlib.Path,
+                        required=True,
+                        help="Output directory for the partitioned associations parquets")
+
+    args = parser.parse_args()
+
+    try:
+        main(associations_parquets_dir=args.associations_parquets_dir,
+             partitioned_dir=args.partitioned_dir)
+
+    except Exception as e:
+        # details on the issue should be in the exception name, print it to stderr and die
+        sys.stderr.write("ERROR in " + script_name + " : " + repr(e) + "\n")
+        sys.exit(1)
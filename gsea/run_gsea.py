@@ -4,6 +4,7 @@ import argparse
 import pathlib
 import logging
 
+import numpy
 import pandas
 
 import blitzgsea
@@ -28,10 +29,10 @@ def run_gsea(gsea_input, library_sets):
     """
     res_df = blitzgsea.gsea(gsea_input, library_sets).reset_index(names="Term")
 
-    # Include all genes in the pathway for convenience
-    res_df["propagated_edge"] = res_df["Term"].apply(
-        lambda t: ",".join(library_sets.get(t, [])) if library_sets.get(t) else ""
-    )
+    # Include all genes in the pathway for convenience: one join per term,
+    # then a vectorized lookup instead of a Python lambda per result row
+    term2genes = {term: ",".join(genes) for (term, genes) in library_sets.items()}
+    res_df["propagated_edge"] = res_df["Term"].map(term2genes).fillna("")
 
     # Extract ID from terms like "Term [R-HSA-12345]" and clean the visible name
     term_series = res_df["Term"]
@@ -50,45 +51,46 @@ def run_gsea(gsea_input, library_sets):
 
     # Ensure FDR (qval) is available: compute from pval if missing
     if "qval" not in res_df.columns and "pval" in res_df.columns:
-        p = pandas.to_numeric(res_df["pval"], errors="coerce")
+        p = pandas.to_numeric(res_df["pval"], errors="coerce").to_numpy(dtype=float)
         n = p.shape[0]
-        # Sort ascending by p-value
-        order = p.sort_values().index
-        ranks = pandas.Series(range(1, n + 1), index=order)
-        q_raw = (p.loc[order] * n / ranks)
-        # Benjamini–Hochberg step-up: cumulative min from bottom
-        q_adj = q_raw.iloc[::-1].cummin().iloc[::-1].clip(upper=1.0)
-        res_df["qval"] = q_adj.reindex(res_df.index).fillna(1.0)
+        # Sort ascending by p-value (NaN last), plain arrays: no index alignment
+        order = numpy.argsort(p, kind="stable")
+        ranks = numpy.arange(1, n + 1)
+        q_raw = p[order] * n / ranks
+        # Benjamini–Hochberg step-up: cumulative min from bottom (fmin skips NaN)
+        q_sorted = numpy.minimum(numpy.fmin.accumulate(q_raw[::-1])[::-1], 1.0)
+        q_adj = numpy.empty(n)
+        q_adj[order] = q_sorted
+        res_df["qval"] = numpy.nan_to_num(q_adj, nan=1.0)
 
     return res_df
 
 
 def filter_pathways_by_pvalue(gsea_results, pval_threshold, fdr_threshold):
     """
-    Filter GSEA results based on p-value or FDR threshold
+    Filter GSEA results based on p-value or FDR threshold,
+    a threshold set to None is not applied
     
     returns:
      - pathways: list of str, significantly enriched pathways
     """
-    # Create p-value and FDR filters
-    mask = pandas.Series(True, index=gsea_results.index)
-    mask &= gsea_results["pval"] <= pval_threshold
-    mask &= gsea_results["qval"] <= fdr_threshold
+    # Create p-value and FDR filters as one boolean array, in place
+    mask = numpy.ones(len(gsea_results), dtype=bool)
+    if pval_threshold is not None:
+        mask &= gsea_results["pval"].to_numpy() <= pval_threshold
+    if fdr_threshold is not None:
+        mask &= gsea_results["qval"].to_numpy() <= fdr_threshold
 
-    gsea_results_filtered = gsea_results.loc[mask, ["ID"]]
-    pathways = gsea_results_filtered["ID"].tolist()
+    pathways = gsea_results["ID"].to_numpy()[mask].tolist()
 
     return pathways
 
 
-def main(target_parquets_dir, associations_parquets_dir, disease, datatype, gmt_file, pval_threshold, fdr_threshold):
-    logger.info("Parsing parquet files")
-    target2symbol = data_parser.parse_target_parquet(target_parquets_dir)
-    target2score = data_parser.parse_associations_parquet(associations_parquets_dir, disease, datatype)
-
+def main(target_parquets_dir, associations_parquets_dir, disease, datatype, gmt_file, pval_threshold, fdr_threshold, top_k, use_cache):
     # Build GSEA input
-    logger.info("Building GSEA input")
-    gsea_input = data_parser.build_gsea_input(target2symbol, target2score)
+    logger.info("Building GSEA input from parquet files")
+    gsea_input = data_parser.parse_gsea_input(target_parquets_dir, associations_parquets_dir,
+                                              disease, datatype, top_k, use_cache)
     library_sets = data_parser.parse_gmt_file(gmt_file)
 
     # Run GSEA
@@ -133,17 +135,23 @@ if __name__ == "__main__":
                         help="Disease EFO ID")
     parser.add_argument("--datatype",
                         type=str,
-                        help="association datatype filter for GSEA, e.g. genetic_association")
+                        help="association datatype filter for GSEA, e.g. genetic_association (default: all datatypes)")
     parser.add_argument("--gmt_file",
                         type=pathlib.Path,
                         required=True,
                         help="Path to Reactome GMT file")
     parser.add_argument("--pval_threshold",
                         type=float,
-                        help="p-value threshold for GSEA")
+                        help="p-value threshold for GSEA (default: no p-value filter)")
     parser.add_argument("--fdr_threshold",
                         type=float,
-                        help="FDR threshold for GSEA")
+                        help="FDR threshold for GSEA (default: no FDR filter)")
+    parser.add_argument("--top_k",
+                        type=int,
+                        help="only use the top_k highest-scoring targets as GSEA input (default: all)")
+    parser.add_argument("--no_cache",
+                        action="store_true",
+                        help="neither read nor write the cache of parsed targets in ~/.cache/targets-from-pathways")
 
     args = parser.parse_args()
 
@@ -154,7 +162,9 @@ if __name__ == "__main__":
             datatype=args.datatype,
             gmt_file=args.gmt_file,
             pval_threshold=args.pval_threshold,
-            fdr_threshold=args.fdr_threshold)
+            fdr_threshold=args.fdr_threshold,
+            top_k=args.top_k,
+            use_cache=not args.no_cache)
 
     except Exception as e:
         # details on the issue should be in the exception name, print it to stderr and die
@@ -1,64 +1,135 @@
 import os
 import sys
+import csv
+import functools
 import logging
 import argparse
 import pathlib
 
-import networkx
+import numpy
+import pandas
+import pyarrow
+import scipy.sparse
+
+# the parsed-data cache is shared with the gsea and reactome scripts
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import pipeline_cache
 
 # set up logger, using inherited config, in case we get called as a module
 logger = logging.getLogger(__name__)
 
 
-def parse_interactions(interactions_file):
+def read_interactions(interactions_file):
+    """
+    Read the directed interactions of a Reactome TSV file with 5 tab-separated columns:
+    Gene1, Gene2, Annotation, Direction, Score
+
+    arguments:
+    - interactions_file
+
+    returns:
+    - pyarrow.Table with 2 columns: source, target
+    """
+    # the header is read as the first row, so the C parser expects its number of fields on
+    # every line: a line with extra fields raises ParserError, a line with missing fields
+    # (or a blank line, kept by skip_blank_lines=False) gets empty trailing fields
+    try:
+        df = pandas.read_csv(interactions_file, sep='\t', header=None, dtype=str, na_filter=False,
+                             skip_blank_lines=False, quoting=csv.QUOTE_NONE, engine='c', memory_map=True)
+    except OSError as e:
+        logger.error("Opening provided Reactome file %s: %s", interactions_file, e)
+        raise Exception("Cannot open provided Reactome file")
+    except pandas.errors.ParserError as e:
+        logger.error("Reactome file %s has bad line (not 5 tab-separated fields): %s",
+                     interactions_file, str(e).strip())
+        raise Exception("Bad line in the Reactome file")
+    except ValueError:
+        # empty file: EmptyDataError, or ValueError if it cannot even be memory-mapped
+        logging.error("Reactome file %s is headerless? expecting headers but got an empty file",
+                      interactions_file)
+        raise Exception("Reactome file problem")
+
+    header = df.iloc[0]
+    if header[0] != "Gene1":
+        logging.error("Reactome file %s is headerless? expecting headers but got %s",
+                      interactions_file, "\t".join(header))
+        raise Exception("Reactome file problem")
+
+    if len(header) != 5:
+        logger.error("Reactome file %s has bad header (not 5 tab-separated fields): %s",
+                     interactions_file, "\t".join(header))
+        raise Exception("Bad line in the Reactome file")
+
+    df = df.iloc[1:]
+
+    # as before, a line ending with an empty Score is stripped to 4 fields and rejected
+    bad_lines = df.iloc[:, 4] == ""
+    if bad_lines.any():
+        logger.error("Reactome file %s has bad line (not 5 tab-separated fields): line %i",
+                     interactions_file, bad_lines.idxmax() + 1)
+        raise Exception("Bad line in the Reactome file")
+
+    (gene1, gene2, direction) = (df.iloc[:, 0], df.iloc[:, 1], df.iloc[:, 3])
+    forward = direction == "->"
+    directed = forward | (direction == "<-")
+
+    sources = gene1.where(forward, gene2)[directed]
+    targets = gene2.where(forward, gene1)[directed]
+
+    return(pyarrow.table({"source": pyarrow.array(sources.to_numpy(), pyarrow.string()),
+                          "target": pyarrow.array(targets.to_numpy(), pyarrow.string())}))
+
+
+def parse_interactions(interactions_file, use_cache=True):
     """
     Parses Reactome TSV file with 5 tab-separated columns: Gene1, Gene2, Annotation, Direction, Score
 
     creates directed functional interactions
+    The directed interactions are cached (see pipeline_cache), later runs on the same file
+    read the cache instead of re-parsing the TSV
 
     arguments:
     - interactions_file
+    - use_cache: bool, read and write the cache (default: True)
 
     returns:
     - interactions: list of tuples
     """
-    interactions = []
-    genes = set()
-    
     try:
-        f = open(interactions_file, 'r')
-    except Exception as e:
+        table = pipeline_cache.cached_table([interactions_file], "interactions",
+                                            functools.partial(read_interactions, interactions_file),
+                                            use_cache)
+    except OSError as e:
         logger.error("Opening provided Reactome file %s: %s", interactions_file, e)
         raise Exception("Cannot open provided Reactome file")
-    
-    # header
-    line = f.readline()
-    if not line.startswith("Gene1\t"):
-        logging.error("Reactome file %s is headerless? expecting headers but got %s",
-                      interactions_file, line)
-        raise Exception("Reactome file problem")
 
-    for line in f:
-        split_line = line.rstrip().split('\t')
+    interactions = list(zip(table["source"].to_pylist(), table["target"].to_pylist()))
 
-        if len(split_line) != 5:
-            logger.error("Reactome file %s has bad line (not 5 tab-separated fields): %s",
-                         interactions_file, line)
-            raise Exception("Bad line in the Reactome file")
+    return(interactions)
 
-        (gene1, gene2, annotation, direction,  score) = split_line
 
-        if direction == "->":
-            interactions.append((gene1, gene2))
-        if direction == "<-":
-            interactions.append((gene2, gene1))
-        
-        genes.add(gene1)
-        genes.add(gene2)
+def interactions_to_matrix(interactions):
+    """
+    Build the adjacency matrix of the directed interaction network
 
-    f.close()
+    arguments:
+    - interactions: list of directed functional interactions
 
-    return(interactions)
+    returns:
+    - adjacency: scipy.sparse.csr_matrix of float32, adjacency[i, j] = 1 iff genes[i] -> genes[j]
+    - genes: numpy array of gene names, the row/column labels
+    """
+    # factorize both endpoints together, so a gene gets the same index as source and target
+    (codes, genes) = pandas.factorize(numpy.array(interactions, dtype=object).reshape(-1))
+    sources = codes[0::2]
+    targets = codes[1::2]
+
+    adjacency = scipy.sparse.csr_matrix((numpy.ones(len(sources), dtype=numpy.float32), (sources, targets)),
+                                        shape=(len(genes), len(genes)))
+    # interactions listed several times were summed, the network is unweighted
+    adjacency.data[:] = 1
+
+    return(adjacency, genes)
 
 
 def interactions_to_TSV(interactions):
@@ -68,16 +139,16 @@ def interactions_to_TSV(interactions):
     arguments:
     - interactions: list of directed functional interactions
     '''
-    for interaction in interactions:
-        print(interaction[0] + "\t" + interaction[1])
+    # one buffered write for all lines instead of a print() per interaction
+    sys.stdout.writelines(gene1 + "\t" + gene2 + "\n" for (gene1, gene2) in interactions)
 
 
-def main(interactions_file):
+def main(interactions_file, use_cache):
     logger.info("Parsing interactions file")
-    interactions = parse_interactions(interactions_file)
+    interactions = parse_interactions(interactions_file, use_cache)
 
-    network = networkx.from_edgelist(interactions)
-    logger.info("Built network with %i nodes and %i interactions", len(network.nodes()), len(network.edges()))
+    (adjacency, genes) = interactions_to_matrix(interactions)
+    logger.info("Built network with %i nodes and %i interactions", adjacency.shape[0], adjacency.nnz)
 
     logger.info("Printing interactions")
     interactions_to_TSV(interactions)
@@ -101,11 +172,15 @@ if __name__ == "__main__":
                         help='Reactome functional interaction file',
                         type=pathlib.Path,
                         required=True)
-    
+    parser.add_argument('--no_cache',
+                        help='neither read nor write the cache of parsed interactions in ~/.cache/targets-from-pathways',
+                        action='store_true')
+
     args = parser.parse_args()
 
     try:
-        main(interactions_file=args.interactions_file)
+        main(interactions_file=args.interactions_file,
+             use_cache=not args.no_cache)
 
     except Exception as e:
         # details on the issue should be in the exception name, print it to stderr and die
@@ -0,0 +1,183 @@
+import os
+import sys
+import csv
+import logging
+import argparse
+import pathlib
+
+import numpy
+import pandas
+
+import parse_interactions
+
+# set up logger, using inherited config, in case we get called as a module
+logger = logging.getLogger(__name__)
+
+
+def read_network(network_file):
+    """
+    Parse the directed interaction network written by parse_interactions.py,
+    2 tab-separated columns: gene1, gene2, no header
+
+    arguments:
+    - network_file
+
+    returns:
+    - adjacency: scipy.sparse.csr_matrix, adjacency[i, j] = 1 iff genes[i] -> genes[j]
+    - genes: numpy array of gene names, the row/column labels
+    """
+    try:
+        df = pandas.read_csv(network_file, sep='\t', header=None, dtype=str,
+                             na_filter=False, quoting=csv.QUOTE_NONE, engine='c')
+    except OSError as e:
+        logger.error("Opening provided network file %s: %s", network_file, e)
+        raise Exception("Cannot open provided network file")
+
+    if df.shape[1] != 2:
+        logger.error("Network file %s has bad lines (not 2 tab-separated fields)", network_file)
+        raise Exception("Bad line in the network file")
+
+    interactions = list(zip(df[0], df[1]))
+
+    return(parse_interactions.interactions_to_matrix(interactions))
+
+
+def parse_seeds(seeds_file):
+    '''
+    Parse seed genes, one gene name per line
+    '''
+    seeds = []
+    f = open(seeds_file, 'r')
+
+    for line in f:
+        seed = line.rstrip('\n')
+        if seed != "":
+            seeds.append(seed)
+
+    f.close()
+
+    return(seeds)
+
+
+def random_walk_with_restart(adjacency, seed_indices, restart_prob, tol=1e-10, max_iter=1000):
+    """
+    Personalized PageRank by power iteration:
+    x = (1 - restart_prob) * P x + restart_prob * s
+    where s is uniform over the seeds. Like MultiXrank on a directed network, the walker
+    goes from a gene to the genes interacting with it (against the interaction direction),
+    so P is the adjacency matrix normalized by in-degree. The walker restarts from the
+    seeds when it reaches a gene without incoming interactions.
+
+    arguments:
+    - adjacency: scipy.sparse.csr_matrix, directed network
+    - seed_indices: list of int, indices of the seed genes
+    - restart_prob: float, probability to restart from the seeds at each step
+    - tol: convergence threshold on the L1 norm of the change of x
+    - max_iter: maximum number of iterations
+
+    returns:
+    - scores: numpy array, stationary probability of each gene (sums to 1)
+    """
+    n = adjacency.shape[0]
+
+    in_degree = numpy.asarray(adjacency.sum(axis=0)).ravel()
+    dangling = in_degree == 0
+    # P, built once: every iteration is then a single SpMV
+    transition = adjacency.multiply(1.0 / numpy.maximum(in_degree, 1)[None, :]).tocsr()
+
+    restart = numpy.zeros(n)
+    restart[seed_indices] = 1.0 / len(seed_indices)
+
+    scores = restart.copy()
+    for i in range(max_iter):
+        walked = transition.dot(scores) + scores[dangling].sum() * restart
+        new_scores = (1 - restart_prob) * walked + restart_prob * restart
+        change = numpy.abs(new_scores - scores).sum()
+        scores = new_scores
+        if change < tol:
+            logger.info("Random walk converged after %i iterations", i + 1)
+            break
+    else:
+        logger.warning("Random walk did not converge after %i iterations", max_iter)
+
+    return(scores)
+
+
+def scores_to_TSV(scores, genes):
+    '''
+    Print scores in descending order to stdout in TSV format, 2 columns: gene_name score
+
+    arguments:
+    - scores: numpy array of scores
+    - genes: numpy array of gene names, same order as scores
+    '''
+    # header
+    sys.stdout.write("GENE\tSCORE\n")
+
+    order = numpy.argsort(-scores, kind="stable")
+    sys.stdout.writelines(gene + "\t" + str(score) + "\n"
+                          for (gene, score) in zip(genes[order], scores[order].tolist()))
+
+
+def main(network_file, seeds_file, restart_prob):
+    logger.info("Parsing network file")
+    (adjacency, genes) = read_network(network_file)
+    logger.info("Built network with %i nodes and %i interactions", adjacency.shape[0], adjacency.nnz)
+
+    gene_index = {gene: i for (i, gene) in enumerate(genes)}
+    seed_indices = []
+    for seed in parse_seeds(seeds_file):
+        if seed not in gene_index:
+            logger.warning("Seed %s not found in the network", seed)
+            continue
+        seed_indices.append(gene_index[seed])
+
+    if len(seed_indices) == 0:
+        logger.error("None of the seeds from %s are in the network", seeds_file)
+        raise Exception("No seeds in the network")
+
+    logger.info("Running random walk with restart from %i seeds", len(seed_indices))
+    scores = random_walk_with_restart(adjacency, seed_indices, restart_prob)
+
+    logger.info("Printing scores")
+    scores_to_TSV(scores, genes)
+
+
+if __name__ == "__main__":
+    script_name = os.path.basename(sys.argv[0])
+    # configure logging, sub-modules will inherit this config
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(name)s: %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S',
+                        level=logging.DEBUG)
+    # set up logger: we want script name rather than 'root'
+    logger = logging.getLogger(script_name)
+
+    parser = argparse.ArgumentParser(
+        prog=script_name,
+        description="Score genes by random walk with restart from seed genes on the interaction network"
+    )
+
+    parser.add_argument('--network_file',
+                        help='Path to interaction network from parse_interactions.py, 2 columns, no header',
+                        type=pathlib.Path,
+                        required=True)
+    parser.add_argument('--seeds_file',
+                        help='Path to file with seed genes, one gene per line, no header',
+                        type=pathlib.Path,
+                        required=True)
+    parser.add_argument('--restart_prob',
+                        help='probability to restart from the seeds at each step (default: 0.5)',
+                        type=float,
+                        default=0.5)
+
+    args = parser.parse_args()
+
+    try:
+        main(network_file=args.network_file,
+             seeds_file=args.seeds_file,
+             restart_prob=args.restart_prob)
+
+    except Exception as e:
+        # details on the issue should be in the exception name, print it to stderr and die
+        sys.stderr.write("ERROR in " + script_name + " : " + repr(e) + "\n")
+        sys.exit(1)
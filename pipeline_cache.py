@@ -0,0 +1,132 @@
+import os
+import time
+import hashlib
+import logging
+import tempfile
+
+import pyarrow
+import pyarrow.feather
+
+# set up logger, using inherited config, in case we get called as a module
+logger = logging.getLogger(__name__)
+
+# parsed input files reused across runs of the gsea, reactome and network_propagation scripts
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "targets-from-pathways")
+
+# cache files unused for CACHE_MAX_AGE_DAYS are deleted, then the least recently used ones
+# while the cache is bigger than CACHE_MAX_BYTES, see clean_cache
+CACHE_MAX_AGE_DAYS = 30
+CACHE_MAX_BYTES = 4 * 1024 ** 3
+
+
+def cache_path(files, name):
+    """
+    Path of the cache file for data parsed from files, keyed on the path, size and
+    modification time of every file, so that a new data release gets a new cache
+
+    arguments:
+    - files: list of paths to the parsed files
+    - name: str, prefix of the cache file name
+
+    returns:
+    - path to a Feather file in CACHE_DIR (may not exist yet)
+    """
+    key = hashlib.sha1()
+    for file in sorted(map(str, files)):
+        stat = os.stat(file)
+        key.update(f"{os.path.abspath(file)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+
+    return(os.path.join(CACHE_DIR, name + "-" + key.hexdigest() + ".feather"))
+
+
+def write_cache(table, cache_file):
+    """
+    Write an Arrow table to an uncompressed Feather file, so that it can be memory-mapped
+    when read back. Failing to write the cache is not fatal
+
+    arguments:
+    - table: pyarrow.Table
+    - cache_file: path to the Feather file
+    """
+    tmp_file = None
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        # write to a temp file unique to this run, then rename: an interrupted run never
+        # leaves a truncated cache, and concurrent runs never write into the same file
+        (fd, tmp_file) = tempfile.mkstemp(dir=os.path.dirname(cache_file), suffix=".tmp")
+        os.close(fd)
+        pyarrow.feather.write_feather(table, tmp_file, compression="uncompressed")
+        os.replace(tmp_file, cache_file)
+    except Exception as e:
+        logger.warning("Cannot write cache file %s: %s", cache_file, e)
+        if tmp_file is not None and os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def clean_cache(keep_file):
+    """
+    Delete the files of CACHE_DIR unused for CACHE_MAX_AGE_DAYS (caches of older data
+    releases, temp files of killed runs), then the least recently used ones while CACHE_DIR
+    is bigger than CACHE_MAX_BYTES. Failing to clean the cache is not fatal
+
+    arguments:
+    - keep_file: path to a cache file that is never deleted, the one just written
+    """
+    try:
+        # oldest first
+        cache_files = sorted((entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                             for entry in os.scandir(CACHE_DIR) if entry.is_file())
+    except OSError as e:
+        logger.warning("Cannot list cache directory %s: %s", CACHE_DIR, e)
+        return
+
+    min_mtime = time.time() - CACHE_MAX_AGE_DAYS * 24 * 3600
+    cache_size = sum(size for (_, size, _) in cache_files)
+
+    for (mtime, size, file) in cache_files:
+        if mtime >= min_mtime and cache_size <= CACHE_MAX_BYTES:
+            break
+        if file == keep_file:
+            continue
+        try:
+            os.remove(file)
+            cache_size -= size
+            logger.info("Removed stale cache file %s", file)
+        except OSError as e:
+            logger.warning("Cannot remove cache file %s: %s", file, e)
+
+
+def cached_table(files, name, read_table, use_cache=True):
+    """
+    Arrow table parsed from files: read from its cache file in CACHE_DIR when there
+    is one, otherwise parsed with read_table and cached for later runs
+
+    arguments:
+    - files: list of paths to the parsed files, the cache is keyed on them (see cache_path)
+    - name: str, prefix of the cache file name
+    - read_table: function without arguments, parses files into a pyarrow.Table
+    - use_cache: bool, if False always call read_table and leave CACHE_DIR untouched
+
+    returns:
+    - pyarrow.Table
+    """
+    if not use_cache:
+        return(read_table())
+
+    cache_file = cache_path(files, name)
+
+    if os.path.exists(cache_file):
+        try:
+            table = pyarrow.feather.read_table(cache_file, memory_map=True)
+            # the modification time records the last use, see clean_cache
+            os.utime(cache_file)
+            logger.info("Read cached %s from %s", name, cache_file)
+            return(table)
+        except (OSError, pyarrow.ArrowInvalid) as e:
+            logger.warning("Cannot read cache file %s, parsing again: %s", cache_file, e)
+
+    table = read_table()
+    write_cache(table, cache_file)
+    clean_cache(cache_file)
+
+    return(table)
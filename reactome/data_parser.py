@@ -1,92 +1,214 @@
+import os
+import sys
+import csv
+import functools
 import logging
-import re
+import collections
+
+import numpy
+import pandas
+import scipy.sparse
+import pyarrow
+import pyarrow.csv
+import pyarrow.compute
+
+# the parsed-data cache is shared with the gsea and network_propagation scripts
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import pipeline_cache
 
 # set up logger, using inherited config, in case we get called as a module
 logger = logging.getLogger(__name__)
 
 
-def parse_pathway_mapping(pathway_mapping_file):
+def read_pathway_mapping(pathway_mapping_file):
     """
-    Maps genes to pathways and vice versa
+    Read the human gene-to-pathway rows of a Reactome mapping file
 
     arguments:
     - pathway_mapping_file
 
     returns:
-    - gene2pathways: dict, key=gene, value=list of pathways with gene
-    - pathway2genes: dict, key=pathway, value=list of genes on pathway
+    - pyarrow.Table with 2 columns: gene, pathwayID
+    """
+    column_names = ["ensembleID", "geneID", "gene", "pathwayID",
+                    "url", "pathway_name", "evidence", "species"]
+
+    try:
+        # Arrow's multi-threaded CSV reader, on the memory-mapped file,
+        # only keeping the 3 columns we need
+        table = pyarrow.csv.read_csv(
+            pyarrow.memory_map(str(pathway_mapping_file)),
+            read_options=pyarrow.csv.ReadOptions(column_names=column_names),
+            parse_options=pyarrow.csv.ParseOptions(delimiter='\t', quote_char=False),
+            convert_options=pyarrow.csv.ConvertOptions(
+                include_columns=["gene", "pathwayID", "species"],
+                column_types={name: pyarrow.string() for name in column_names},
+                strings_can_be_null=False))
+    except OSError as e:
+        logger.error("Opening provided Reactome mapping file %s: %s", pathway_mapping_file, e)
+        raise Exception("Cannot open provided Reactome mapping file")
+    except pyarrow.ArrowInvalid as e:
+        logger.error("Reactome file %s has bad line (not 8 tab-separated fields): %s",
+                     pathway_mapping_file, e)
+        raise Exception("Bad line in the Reactome mapping file")
+
+    table = table.filter(pyarrow.compute.equal(table["species"], "Homo sapiens"))
+
+    genes = pyarrow.compute.list_element(
+        pyarrow.compute.split_pattern(table["gene"], " ", max_splits=1), 0)
+    # skip if not a gene, allow for: letters, digits, "_", "-"
+    is_gene = pyarrow.compute.match_substring_regex(genes, r'^[a-zA-Z0-9\-_]+$')
+
+    return(pyarrow.table({"gene": genes.filter(is_gene),
+                          "pathwayID": table["pathwayID"].filter(is_gene)}))
+
+
+def parse_pathway_mapping(pathway_mapping_file, use_cache=True):
     """
-    gene2pathways = {}
-    pathway2genes = {}
+    Maps genes to pathways
+    The human gene-pathway rows are cached (see pipeline_cache), later runs on the same file
+    read the cache instead of re-parsing the TSV
 
+    arguments:
+    - pathway_mapping_file
+    - use_cache: bool, read and write the cache (default: True)
+
+    returns:
+    - gene2pathways: dict, key=gene, value=frozenset of pathways with gene
+    """
     try:
-        f = open(pathway_mapping_file, 'r')
-    except Exception as e:
+        table = pipeline_cache.cached_table([pathway_mapping_file], "pathway_mapping",
+                                            functools.partial(read_pathway_mapping, pathway_mapping_file),
+                                            use_cache)
+    except OSError as e:
         logger.error("Opening provided Reactome mapping file %s: %s", pathway_mapping_file, e)
         raise Exception("Cannot open provided Reactome mapping file")
 
-    re_gene = re.compile(r'^[a-zA-Z0-9\-_]+$')  # allow for: letters, digits, "_", "-"
+    # each gene and pathway is on many rows: intern them, so that all dict keys and
+    # set members share one string object per name
+    genes = list(map(sys.intern, table["gene"].to_pylist()))
+    pathways = list(map(sys.intern, table["pathwayID"].to_pylist()))
+    del table
+
+    # sets: a gene-pathway pair listed on several lines (eg several Ensembl IDs) is only kept once
+    gene2pathways = collections.defaultdict(set)
+    for (gene_name, pathwayID) in zip(genes, pathways):
+        gene2pathways[gene_name].add(pathwayID)
 
-    for line in f:
-        split_line = line.rstrip('\n').split('\t')
+    # plain dict of frozensets: a missing key raises KeyError instead of being silently added
+    gene2pathways = {gene: frozenset(paths) for (gene, paths) in gene2pathways.items()}
 
-        if len(split_line) != 8:
-            logger.error("Reactome file %s has bad line (not 8 tab-separated fields): %s",
-                         pathway_mapping_file, line)
-            raise Exception("Bad line in the Reactome mapping file")
+    logger.info("Found %i genes on %i pathways", len(gene2pathways), len(set(pathways)))
 
-        (ensembleID, geneID, gene, pathwayID, url, pathway_name, evidence, species) = split_line
+    return(gene2pathways)
 
-        if species != "Homo sapiens":
-            continue
-        
-        gene_name = gene.split(" ")[0]
-        # skip if not a gene
-        if not re_gene.match(gene_name):
-            continue
 
-        if gene_name in gene2pathways:
-            gene2pathways[gene_name].append(pathwayID)
-        else:
-            gene2pathways[gene_name] = [pathwayID]
+# gene-by-pathway membership matrix with its row and column labels, see pathway_matrix
+PathwayMatrix = collections.namedtuple("PathwayMatrix", ["matrix", "genes", "gene_index", "pathway_index"])
 
-        if pathwayID in pathway2genes:
-            pathway2genes[pathwayID].append(gene_name)
-        else:
-            pathway2genes[pathwayID] = [gene_name]
 
-    f.close()
+def pathway_matrix(gene2pathways):
+    """
+    Build the gene-by-pathway membership matrix
+
+    arguments:
+    - gene2pathways: dict, key=gene, value=frozenset of pathways with gene
+
+    returns:
+    - PathwayMatrix with fields:
+      - matrix: scipy.sparse.csr_matrix of int32, matrix[i, j] = 1 iff gene i is on pathway j
+      - genes: numpy array of gene names, genes[i] is the gene of row i
+      - gene_index: dict, key=gene, value=row index
+      - pathway_index: dict, key=pathway, value=column index
+    """
+    gene_index = {gene: i for (i, gene) in enumerate(gene2pathways)}
+    pathway_index = {}
+    rows = []
+    cols = []
+    for (gene, pathways) in gene2pathways.items():
+        for pathway in pathways:
+            rows.append(gene_index[gene])
+            cols.append(pathway_index.setdefault(pathway, len(pathway_index)))
 
-    logger.info("Found %i genes on %i pathways", len(gene2pathways), len(pathway2genes))
+    matrix = scipy.sparse.csr_matrix((numpy.ones(len(rows), dtype=numpy.int32), (rows, cols)),
+                                     shape=(len(gene_index), len(pathway_index)))
 
-    return(gene2pathways, pathway2genes)
+    genes = numpy.array(list(gene_index), dtype=object)
+
+    return(PathwayMatrix(matrix, genes, gene_index, pathway_index))
+
+
+@functools.lru_cache(maxsize=16)
+def read_first_column(file, mtime_ns):
+    '''
+    Read the first tab-separated field of every non-empty line of a file, cached on
+    (file, mtime_ns) so that a file that did not change is only read once per process
+
+    returns:
+    - tuple of str, immutable so that the cached value can be shared safely
+    '''
+    with open(file, 'r', buffering=1 << 20, newline='') as f:
+        reader = csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE)
+        fields = tuple(row[0] for row in reader if row)
+
+    return(fields)
 
 
 def parse_disease_pathways(file):
     '''
     Parse significantly enriched pathways from GSEA, one pathway ID per line
+
+    returns:
+    - frozenset of pathway IDs
     '''
-    list = []
-    f = open(file, 'r')
+    return(frozenset(read_first_column(file, os.stat(file).st_mtime_ns)))
 
-    for line in f:
-        list.append(line.rstrip('\n'))
 
-    f.close()
+def scores_to_dataframe(scores, gene2pathways):
+    """
+    Scores of one target as a table sorted by descending score
 
-    return(list)
+    arguments:
+    - scores: dict with key=gene, value=score
+    - gene2pathways: dict, key=gene, value=frozenset of pathways with gene
+
+    returns:
+    - pandas.DataFrame with 3 columns: GENE, SCORE, PATHWAYS
+    """
+    df = pandas.DataFrame({"GENE": list(scores.keys()),
+                           "SCORE": list(scores.values())})
+    df["PATHWAYS"] = [",".join(sorted(gene2pathways[gene])) for gene in df["GENE"]]
+
+    # stable sort: genes with equal scores keep their order, as with sorted()
+    return(df.sort_values("SCORE", ascending=False, kind="stable"))
 
 
 def scores_to_TSV(scores, gene2pathways):
     '''
-    Print scores in descending order to stdout in TSV format, 2 columns: gene_name score
+    Print scores in descending order to stdout in TSV format, 3 columns: gene_name score pathways
 
     arguments:
     - scores: dict with key=gene, value=score
+    - gene2pathways: dict, key=gene, value=frozenset of pathways with gene
+    '''
+    df = scores_to_dataframe(scores, gene2pathways)
+    # one C-level write of the whole table, header included
+    df.to_csv(sys.stdout, sep='\t', index=False, lineterminator='\n')
+
+
+def target_scores_to_TSV(target2scores, gene2pathways):
+    '''
+    Print the scores of several targets to stdout in TSV format, 4 columns:
+    target gene_name score pathways, each target's genes in descending score order
+
+    arguments:
+    - target2scores: dict with key=target, value=dict with key=gene, value=score
+    - gene2pathways: dict, key=gene, value=frozenset of pathways with gene
     '''
-    # header
-    print("GENE\tSCORE\tPATHWAYS")
+    dfs = []
+    for (target, scores) in target2scores.items():
+        df = scores_to_dataframe(scores, gene2pathways)
+        df.insert(0, "TARGET", target)
+        dfs.append(df)
 
-    for (gene, score) in sorted(scores.items(), key=lambda item: item[1], reverse=True):
-        pathways = ",".join(gene2pathways[gene])
-        print(gene + "\t" + str(score) + "\t" + pathways)
\ No newline at end of file
+    pandas.concat(dfs).to_csv(sys.stdout, sep='\t', index=False, lineterminator='\n')
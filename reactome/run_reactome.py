@@ -3,6 +3,9 @@ import sys
 import logging
 import argparse
 import pathlib
+import multiprocessing
+
+import numpy
 
 import data_parser
 
@@ -10,123 +13,213 @@ import data_parser
 logger = logging.getLogger(__name__)
 
 
-def get_disease_genes(pathway2genes, disease_pathways):
+def pathway_indicator(pathway_index, paths):
+    """
+    Indicator vector of a set of pathways over the columns of the pathway matrix
+
+    arguments:
+    - pathway_index: dict, key=pathway, value=column index
+    - paths: iterable of pathways, pathways missing from pathway_index are ignored
+
+    returns:
+    - numpy array of int32, 1 for the columns of paths and 0 elsewhere
+    """
+    indicator = numpy.zeros(len(pathway_index), dtype=numpy.int32)
+    indicator[[pathway_index[path] for path in paths if path in pathway_index]] = 1
+
+    return(indicator)
+
+
+def genes_on_pathways(membership, paths):
+    """
+    Find all genes that are on at least one of paths: the rows of the pathway
+    matrix with a non-zero product with the indicator of paths
+
+    arguments:
+    - membership: data_parser.PathwayMatrix, as returned by data_parser.pathway_matrix
+    - paths: iterable of pathways
+
+    returns:
+    - set of genes
+    """
+    rows = numpy.flatnonzero(membership.matrix.dot(pathway_indicator(membership.pathway_index, paths)))
+
+    return(set(membership.genes[rows].tolist()))
+
+
+def get_disease_genes(membership, disease_pathways):
     """
     Find all genes that are on disease-specific pathways
 
     arguments:
-    - pathway2genes: dict, key=pathway, value=list of genes
-    - disease_pathways
+    - membership: data_parser.PathwayMatrix, as returned by data_parser.pathway_matrix
+    - disease_pathways: frozenset of disease-specific pathways
     
     returns:
-    - list of disease-specific genes
+    - set of disease-specific genes
     """
-    disease_genes = set()
+    missing_paths = sorted(path for path in disease_pathways if path not in membership.pathway_index)
+    if missing_paths:
+        # one aggregate warning rather than a log record per pathway
+        logger.warning("%i pathway(s) not found in the pathway mapping: %s",
+                       len(missing_paths), ", ".join(missing_paths))
 
-    for path in disease_pathways:
-        if path not in pathway2genes:
-            logger.warning("Pathway %s not found in pathway2genes mapping", path)
-            continue
-        genes_on_path = pathway2genes[path]
+    disease_genes = genes_on_pathways(membership, disease_pathways)
+    logger.debug("Merged %i disease pathways into %i genes", len(disease_pathways), len(disease_genes))
 
-        for gene in genes_on_path:
-            disease_genes.add(gene)
-    
     return(disease_genes)
 
 
-def get_target_genes(gene2pathways, pathway2genes, target):
+def get_target_genes(membership, target_paths):
     """
     Find all genes that are on the same pathways as target
 
     arguments:
-    - gene2pathways: dict, key=gene, value=list of pathways with gene
-    - pathway2genes: dict, key=pathway, value=list of genes on pathway
-    - target: str, gene name of the target of interest
+    - membership: data_parser.PathwayMatrix, as returned by data_parser.pathway_matrix
+    - target_paths: frozenset of pathways with the target of interest
     
     returns:
-    - list of target-specific genes
+    - set of target-specific genes
     """
-    target_genes = set()
-
-    target_paths = gene2pathways[target]
-    for path in target_paths:
-        genes_on_path = pathway2genes[path]
-        for gene in genes_on_path:
-            target_genes.add(gene)
+    target_genes = genes_on_pathways(membership, target_paths)
 
     return(target_genes)
 
 
-def find_overlap(list1, list2):
+def find_overlap(disease_genes, target_genes):
     """
     Find all genes that are both disease-specific and on the same pathways as target
 
     arguments:
-    - list of disease-specific genes
-    - list of target-specific genes
+    - disease_genes: set of disease-specific genes
+    - target_genes: set of target-specific genes
+
+    returns:
+    - set of disease- and target-specific genes
     """
-    overlap = list(set(list1) & set(list2))
-    return(overlap)
+    return(disease_genes & target_genes)
 
 
-def calculate_scores(genes, gene2pathways, pathway2genes, disease_pathways, target):
+def calculate_scores(genes, membership, disease_pathways, target_paths):
     """
     For every disease- and target-specific gene:
     score = (#disease_paths_with_gene + #target_paths_with_gene) / (#disese_paths + #target_paths)
 
     arguments:
-    - genes: list of disease- and target-specific genes
-    - gene2pathways: dict, key=gene, value=list of pathways with gene
-    - pathway2genes: dict, key=pathway, value=list of genes on pathway
-    - target: str, gene name of the target of interest
+    - genes: set of disease- and target-specific genes
+    - membership: data_parser.PathwayMatrix, as returned by data_parser.pathway_matrix
+    - disease_pathways: frozenset of disease-specific pathways
+    - target_paths: frozenset of pathways with the target of interest
     
     returns:
     - scores: dict, key=gene, value=score
     """
-    scores = {}
+    # per-pathway weights: 1 for each disease pathway plus 1 for each target pathway
+    weights = (pathway_indicator(membership.pathway_index, disease_pathways)
+               + pathway_indicator(membership.pathway_index, target_paths))
 
-    for gene in genes:
-        # #disease_paths_with_gene
-        gene_paths = gene2pathways[gene]
-        disease_paths_with_gene = find_overlap(gene_paths, disease_pathways)
+    # #disease_paths_with_gene + #target_paths_with_gene for all genes, as one SpMV
+    counts = membership.matrix.dot(weights)
 
-        # #target_paths_with_gene
-        target_paths = gene2pathways[target]
-        target_path_count = 0
-        for path in target_paths:
-            path_genes = pathway2genes[path]
-            if gene in path_genes:
-                target_path_count += 1
+    rows = [membership.gene_index[gene] for gene in genes]
+    denominator = len(disease_pathways) + len(target_paths)
+    scores = dict(zip(genes, (counts[rows] / denominator).tolist()))
 
-        scores[gene] = (len(disease_paths_with_gene) + target_path_count) / (len(disease_pathways) + len(target_paths))
+    return(scores)
+
+
+# target-independent data, set once per process by init_scoring
+shared_data = {}
+
+
+def init_scoring(gene2pathways, membership, disease_pathways, disease_genes):
+    """
+    Store the target-independent data used by score_target.
+    Used as Pool initializer: with the fork start method (default on Linux) the workers
+    share these (read-only) structures with the parent, with the spawn start method
+    (default on macOS and Windows) each worker receives a pickled copy once
+    """
+    # spawned workers start from a fresh interpreter, without the logging config of the
+    # parent: set it up again (no-op in the parent and in forked workers)
+    if not logging.getLogger().handlers:
+        logging.basicConfig(format='%(asctime)s %(levelname)s %(name)s: %(message)s',
+                            datefmt='%Y-%m-%d %H:%M:%S',
+                            level=logging.DEBUG)
+
+    shared_data["gene2pathways"] = gene2pathways
+    shared_data["membership"] = membership
+    shared_data["disease_pathways"] = disease_pathways
+    shared_data["disease_genes"] = disease_genes
+
+
+def score_target(target):
+    """
+    Score the disease- and target-specific genes of one target, using the data
+    stored by init_scoring
+
+    arguments:
+    - target: str, gene name of the target of interest
+
+    returns:
+    - scores: dict, key=gene, value=score
+    """
+    # the target's pathways, looked up once for all the steps below
+    target_paths = shared_data["gene2pathways"][target]
+
+    target_genes = get_target_genes(shared_data["membership"], target_paths)
+    logger.info("Found %i genes that are on the same pathways as target %s", len(target_genes), target)
+
+    disease_and_target_genes = find_overlap(shared_data["disease_genes"], target_genes)
+    logger.info("Found %i genes that are both disease-specific and on the same pathways as target %s",
+                len(disease_and_target_genes), target)
+
+    # Pathway selectivity
+    scores = calculate_scores(disease_and_target_genes, shared_data["membership"],
+                              shared_data["disease_pathways"], target_paths)
 
     return(scores)
 
 
-def main(pathway_mapping_file, disease_pathways_file, target):
+def main(pathway_mapping_file, disease_pathways_file, targets, jobs, use_cache):
 
     logger.info("Parsing gene-to-pathway mapping file")
-    (gene2pathways, pathway2genes) = data_parser.parse_pathway_mapping(pathway_mapping_file)
+    gene2pathways = data_parser.parse_pathway_mapping(pathway_mapping_file, use_cache)
+
+    # check all targets up front, rather than failing in the middle of the batch
+    if len(targets) == 0:
+        logger.error("No target given")
+        raise Exception("No target given")
+    missing_targets = [target for target in targets if target not in gene2pathways]
+    if missing_targets:
+        logger.error("%i target(s) not found in the pathway mapping: %s",
+                     len(missing_targets), ", ".join(missing_targets))
+        raise Exception("Target not found in the pathway mapping")
+
+    # integer-indexed gene-by-pathway matrix, used for all set operations below
+    membership = data_parser.pathway_matrix(gene2pathways)
 
     logger.info("Parsing GSEA results")
     disease_pathways = data_parser.parse_disease_pathways(disease_pathways_file)
     logger.info("Found %i disease-specific pathways", len(disease_pathways))
     
-    # Finding disease-specific and target-specific genes
-    disease_genes = get_disease_genes(pathway2genes, disease_pathways)
+    # Finding disease-specific genes, shared by all targets
+    disease_genes = get_disease_genes(membership, disease_pathways)
     logger.info("Found %i disease-specific genes", len(disease_genes))
 
-    target_genes = get_target_genes(gene2pathways, pathway2genes, target)
-    logger.info("Found %i genes that are on the same pathways as target", len(target_genes))
+    shared = (gene2pathways, membership, disease_pathways, disease_genes)
 
-    disease_and_target_genes = find_overlap(disease_genes, target_genes)
-    logger.info("Found %i genes that are both disease-specific and on the same pathways as target", len(disease_and_target_genes))
+    logger.info("Calculating scores for %i target(s)", len(targets))
+    if jobs > 1 and len(targets) > 1:
+        with multiprocessing.Pool(min(jobs, len(targets)), initializer=init_scoring, initargs=shared) as pool:
+            target2scores = dict(zip(targets, pool.map(score_target, targets)))
+    else:
+        init_scoring(*shared)
+        target2scores = {target: score_target(target) for target in targets}
 
-    # Pathway selectivity
-    logger.info("Calculating scores")
-    scores = calculate_scores(disease_and_target_genes, gene2pathways, pathway2genes, disease_pathways, target)
-    data_parser.scores_to_TSV(scores, gene2pathways)
+    if len(targets) == 1:
+        data_parser.scores_to_TSV(target2scores[targets[0]], gene2pathways)
+    else:
+        data_parser.target_scores_to_TSV(target2scores, gene2pathways)
 
 
 if __name__ == "__main__":
@@ -152,16 +245,25 @@ if __name__ == "__main__":
                         type=pathlib.Path,
                         required=True)
     parser.add_argument('--target',
-                        help='target gene name',
+                        help='target gene name, or several comma-separated target gene names',
                         type=str,
                         required=True)
+    parser.add_argument('--jobs',
+                        help='number of processes scoring targets in parallel (default: 1)',
+                        type=int,
+                        default=1)
+    parser.add_argument('--no_cache',
+                        help='neither read nor write the cache of the parsed mapping in ~/.cache/targets-from-pathways',
+                        action='store_true')
 
     args = parser.parse_args()
 
     try:
         main(pathway_mapping_file=args.pathway_mapping_file,
              disease_pathways_file=args.disease_pathways_file,
-             target=args.target)
+             targets=[target.strip() for target in args.target.split(",") if target.strip()],
+             jobs=args.jobs,
+             use_cache=not args.no_cache)
 
     except Exception as e:
         # details on the issue should be in the exception name, print it to stderr and die